@@ -0,0 +1,29 @@
+"""
+Gunicorn configuration for the email tracking server
+Run with: gunicorn -c gunicorn_conf.py tracking_server:app
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Threaded workers: /track and /click only queue their writes, so a few
+# processes with several threads each cover an open burst.
+# Memory: each worker holds its own SQLite pool, capped at ~144MB of page
+# cache (DB_CACHE_KIB x 9 connections in tracking_server.py), so budget
+# roughly that per worker on top of the app itself; lower WEB_CONCURRENCY on
+# small instances.
+# Each worker also has its own in-process caches - the link URL cache, the
+# 10s dashboard page cache and the repeat-open (304) window - so a repeat
+# pixel fetch or a dashboard refresh landing on another worker is a miss
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = 8
+
+# Mail clients and image proxies often fetch several pixels over one connection
+keepalive = 30
+
+# Each worker starts its own batch writer and log listener threads on import,
+# which would not survive a fork from a preloaded master
+preload_app = False
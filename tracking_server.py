@@ -4,55 +4,534 @@ Email Tracking Server
 Tracks email opens via pixel tracking and link clicks
 """
 
-from flask import Flask, Response, request, redirect
+from flask import Flask, request, redirect, stream_template_string
 import sqlite3
+import os
+import queue
+import threading
+import time
+import atexit
+import logging
+import logging.handlers
+from contextlib import contextmanager
+from functools import lru_cache, wraps
 from datetime import datetime
-import uuid
-import re
 
 app = Flask(__name__)
 
 # 1x1 transparent pixel (hardcoded bytes - no PIL needed)
 TRACKING_PIXEL = b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\x00\x00\x00\x21\xf9\x04\x01\x00\x00\x00\x00\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02\x44\x01\x00\x3b'
 
-def init_database():
-    """Initialize the tracking database"""
-    conn = sqlite3.connect('email_tracking.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS email_tracking (
-            tracking_id TEXT PRIMARY KEY,
-            recipient_email TEXT,
-            subject TEXT,
-            sent_at TIMESTAMP,
-            opened_at TIMESTAMP,
-            open_count INTEGER DEFAULT 0,
-            user_agent TEXT,
-            ip_address TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-    
-    # Also initialize link tracking
-    conn = sqlite3.connect('link_tracking.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS link_tracking (
-            link_id TEXT PRIMARY KEY,
-            original_url TEXT,
-            email_id TEXT,
-            recipient_email TEXT,
-            created_at TIMESTAMP,
-            click_count INTEGER DEFAULT 0,
-            last_clicked TIMESTAMP,
-            user_agent TEXT,
-            ip_address TEXT
-        )
-    ''')
+# Built once and returned with the pixel; no-store makes clients refetch it,
+# so every open reaches /track
+PIXEL_ETAG = 'W/"pixel"'
+PIXEL_RESPONSE_HEADERS = {
+    'Content-Type': 'image/gif',
+    'Content-Length': str(len(TRACKING_PIXEL)),
+    'Cache-Control': 'no-store, no-cache, must-revalidate, max-age=0',
+    'Pragma': 'no-cache',
+    'ETag': PIXEL_ETAG,
+}
+PIXEL_NOT_MODIFIED_HEADERS = {
+    'Cache-Control': PIXEL_RESPONSE_HEADERS['Cache-Control'],
+    'Pragma': 'no-cache',
+    'ETag': PIXEL_ETAG,
+}
+
+# Log records are handed to a background listener thread, so request
+# handlers never block on writing them out
+LOG_FILE = 'tracking_server.log'
+
+logger = logging.getLogger('tracking')
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_queue = queue.Queue()
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+
+# Several gunicorn workers append to the same file, so rotation is left to
+# an external logrotate; WatchedFileHandler reopens the file after it moves
+_file_handler = logging.handlers.WatchedFileHandler(LOG_FILE, encoding='utf-8')
+_file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+# Problems still show up in the console / platform logs
+_console_handler = logging.StreamHandler()
+_console_handler.setLevel(logging.WARNING)
+
+_log_listener = logging.handlers.QueueListener(
+    _log_queue, _file_handler, _console_handler, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# Opens and link clicks share one database file
+DB_PATH = 'email_tracking.db'
+# Link tracking used to live in its own file; it is copied into DB_PATH once
+LEGACY_LINK_DB = 'link_tracking.db'
+
+# Page cache per connection, in KiB. Each process holds 9 pooled connections
+# (see SQLitePool), so this bounds SQLite's cache at ~144MB per gunicorn
+# worker; the OS page cache and mmap are shared on top of that
+DB_CACHE_KIB = 16000
+
+# Applied to every new connection - WAL lets /stats readers run alongside the
+# /track and /click writers, NORMAL sync drops the per-commit fsync
+DB_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    f'PRAGMA cache_size=-{DB_CACHE_KIB}',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA busy_timeout=30000',
+    'PRAGMA foreign_keys=ON',
+)
+
+# Statements run on every request or flush, kept together in one place
+SQL_UPDATE_OPENS = '''
+    UPDATE email_tracking 
+    SET opened_at = ?, 
+        open_count = COALESCE(open_count, 0) + ?, 
+        user_agent = ?, 
+        ip_address = ?
+    WHERE tracking_id = ?
+'''
+
+SQL_UPDATE_CLICKS = '''
+    UPDATE link_tracking 
+    SET last_clicked = ?, 
+        click_count = COALESCE(click_count, 0) + ?, 
+        user_agent = ?, 
+        ip_address = ?
+    WHERE link_id = ?
+'''
+
+SQL_SELECT_URL = 'SELECT original_url FROM link_tracking WHERE link_id = ?'
+
+SQL_INSERT_LINK = '''
+    INSERT INTO link_tracking 
+    (link_id, original_url, email_id, recipient_email, created_at) 
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+SQL_SELECT_STATS = '''
+    SELECT 
+        recipient_email,
+        subject,
+        sent_at,
+        opened_at,
+        open_count,
+        user_agent
+    FROM email_tracking
+    ORDER BY sent_at DESC
+    LIMIT 100
+'''
+
+SQL_SELECT_LINK_STATS = '''
+    SELECT 
+        recipient_email,
+        original_url,
+        click_count,
+        last_clicked,
+        created_at
+    FROM link_tracking
+    ORDER BY last_clicked DESC, created_at DESC
+    LIMIT 100
+'''
+
+def connect_db(db_path):
+    """Open a database connection with the server pragmas applied"""
+    # IMMEDIATE takes the write lock when a write transaction starts instead
+    # of upgrading later, so concurrent writers wait rather than hit SQLITE_BUSY
+    # uri=True lets ATTACH take file: URIs, used for the read-only legacy migration
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level='IMMEDIATE',
+                           check_same_thread=False, uri=True)
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+class SQLitePool:
+    """One shared write connection plus a queue of read connections"""
+
+    def __init__(self, db_path, readers=8):
+        self.db_path = db_path
+        self.write_conn = None
+        self.write_lock = threading.Lock()
+        self.read_conns = queue.Queue()
+        try:
+            self.write_conn = connect_db(db_path)
+            for _ in range(readers):
+                self.read_conns.put(connect_db(db_path))
+        except Exception:
+            self.close()
+            raise
+
+    @contextmanager
+    def read(self):
+        """Borrow a read connection, returning it to the pool afterwards"""
+        conn = self.read_conns.get()
+        try:
+            yield conn
+        finally:
+            self.read_conns.put(conn)
+
+    @contextmanager
+    def write(self):
+        """Hold the write connection, committing on success and rolling back on error"""
+        with self.write_lock:
+            if self.write_conn is None:
+                raise sqlite3.ProgrammingError(f"Connection pool for {self.db_path} is closed")
+            try:
+                yield self.write_conn
+                self.write_conn.commit()
+            except Exception:
+                self.write_conn.rollback()
+                raise
+
+    def close(self):
+        """Close the write connection and every idle read connection"""
+        with self.write_lock:
+            if self.write_conn is not None:
+                self.write_conn.close()
+                self.write_conn = None
+        while True:
+            try:
+                self.read_conns.get_nowait().close()
+            except queue.Empty:
+                break
+
+db_pool = None
+_init_lock = threading.Lock()
+
+# Opens and clicks are buffered and written in batches by background threads,
+# so the pixel and redirect responses never wait on a commit
+BATCH_SIZE = 256
+BATCH_INTERVAL = 0.5  # seconds
+
+# Set at shutdown so the writer threads finish their current batch and exit
+_writers_stop = threading.Event()
+_writer_threads = []
+
+class PendingWrites:
+    """Buffered counter updates, merged per tracking/link id until the next flush"""
+
+    def __init__(self):
+        # id -> [count, user_agent, ip_address]
+        self.updates = {}
+        self.cond = threading.Condition()
+
+    def add(self, key, user_agent, ip_address):
+        """Record one event, folding it into any update already pending for key"""
+        with self.cond:
+            pending = self.updates.get(key)
+            if pending is None:
+                self.updates[key] = [1, user_agent, ip_address]
+                if len(self.updates) >= BATCH_SIZE:
+                    self.cond.notify()
+            else:
+                pending[0] += 1
+                pending[1] = user_agent
+                pending[2] = ip_address
+
+    def take(self, timeout=None):
+        """Swap out the buffered updates, waiting up to timeout for a full batch"""
+        with self.cond:
+            if timeout is not None and len(self.updates) < BATCH_SIZE:
+                self.cond.wait(timeout)
+            updates, self.updates = self.updates, {}
+        # Every event in a batch is stamped with the flush time (epoch seconds,
+        # at most BATCH_INTERVAL late). Rows match the placeholder order of
+        # write_opens/write_clicks
+        now = int(time.time())
+        return [(now, count, user_agent, ip_address, key)
+                for key, (count, user_agent, ip_address) in updates.items()]
+
+pending_opens = PendingWrites()
+pending_clicks = PendingWrites()
+
+def write_opens(rows):
+    """Apply a batch of merged open rows, returning how many matched a tracking ID"""
+    with db_pool.write() as conn:
+        cursor = conn.executemany(SQL_UPDATE_OPENS, rows)
+    return cursor.rowcount
+
+def write_clicks(rows):
+    """Apply a batch of merged click rows, returning how many matched a link ID"""
+    with db_pool.write() as conn:
+        cursor = conn.executemany(SQL_UPDATE_CLICKS, rows)
+    return cursor.rowcount
+
+def write_in_batches(write, rows):
+    """Apply rows in transactions of at most BATCH_SIZE, returning how many matched"""
+    # The buffer keeps filling while a flush is running, so one take() can
+    # return more than BATCH_SIZE ids. Chunking keeps each transaction (a few
+    # hundred short rows, well under 1MB) and the WAL growth between
+    # checkpoints small
+    updated = 0
+    for start in range(0, len(rows), BATCH_SIZE):
+        updated += write(rows[start:start + BATCH_SIZE])
+    return updated
+
+def batch_writer(pending, write):
+    """Background loop that flushes buffered updates in batched transactions"""
+    while not _writers_stop.is_set():
+        rows = pending.take(BATCH_INTERVAL)
+        if not rows:
+            continue
+        try:
+            updated = write_in_batches(write, rows)
+            if updated < len(rows):
+                logger.warning("✗ %d of %d IDs not found in database", len(rows) - updated, len(rows))
+        except Exception as e:
+            logger.error("Batch write error: %s", e)
+
+def flush_pending():
+    """Write out anything still buffered, used at shutdown"""
+    if db_pool is None:
+        return
+    for pending, write in ((pending_opens, write_opens), (pending_clicks, write_clicks)):
+        rows = pending.take()
+        if rows:
+            write_in_batches(write, rows)
+
+def close_database():
+    """Close the pooled connections, used at shutdown"""
+    if db_pool is not None:
+        db_pool.close()
+
+def shutdown_database():
+    """Stop the batch writers, flush what they left buffered and close the pool"""
+    # Joining first means no writer is mid-batch when the connections close
+    _writers_stop.set()
+    for thread in _writer_threads:
+        thread.join()
+    flush_pending()
+    close_database()
+
+atexit.register(shutdown_database)
+
+def migrate_legacy_link_db(conn):
+    """Copy rows from the old standalone link_tracking.db, then retire that file"""
+    if not os.path.exists(LEGACY_LINK_DB):
+        return
+
+    # Read-only, so if another worker renamed the file in the meantime ATTACH
+    # fails instead of creating an empty link_tracking.db
+    try:
+        conn.execute('ATTACH DATABASE ? AS legacy', (f'file:{LEGACY_LINK_DB}?mode=ro',))
+    except sqlite3.OperationalError:
+        if not os.path.exists(LEGACY_LINK_DB):
+            return
+        raise
+
+    try:
+        cursor = conn.execute(
+            "SELECT 1 FROM legacy.sqlite_master WHERE type='table' AND name='link_tracking'")
+        if cursor.fetchone() is None:
+            # Nothing to copy, treat it as already migrated
+            return
+        conn.execute('''
+            INSERT OR IGNORE INTO link_tracking
+            (link_id, original_url, email_id, recipient_email, created_at,
+             click_count, last_clicked, user_agent, ip_address)
+            SELECT link_id, original_url, email_id, recipient_email, created_at,
+                   click_count, last_clicked, user_agent, ip_address
+            FROM legacy.link_tracking
+        ''')
+        conn.commit()
+    finally:
+        conn.execute('DETACH DATABASE legacy')
+
+    # Another worker may have migrated it first. Any WAL files go with it
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.replace(LEGACY_LINK_DB + suffix, LEGACY_LINK_DB + '.migrated' + suffix)
+        except FileNotFoundError:
+            pass
+    logger.info("Migrated link tracking from %s into %s", LEGACY_LINK_DB, DB_PATH)
+
+# Timestamps this server writes are stored as Unix epoch seconds. Rows
+# written before that change hold datetime.now() text in local time.
+# sent_at is left out: the external sender writes it in its own format
+TIMESTAMP_COLUMNS = (
+    ('email_tracking', 'opened_at'),
+    ('link_tracking', 'created_at'),
+    ('link_tracking', 'last_clicked'),
+)
+# Stored in PRAGMA user_version once the conversion has run
+EPOCH_TIMESTAMPS_VERSION = 1
+
+def migrate_text_timestamps(conn):
+    """Convert text timestamps left by older versions to epoch seconds, once per database"""
+    # Take the write lock before checking, so only one worker runs the conversion
+    conn.execute('BEGIN IMMEDIATE')
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= EPOCH_TIMESTAMPS_VERSION:
+        conn.rollback()
+        return
+
+    for table, column in TIMESTAMP_COLUMNS:
+        # Text SQLite can't parse is kept rather than turned into NULL
+        conn.execute(f'''
+            UPDATE {table}
+            SET {column} = CAST(strftime('%s', {column}, 'utc') AS INTEGER)
+            WHERE typeof({column}) = 'text'
+              AND strftime('%s', {column}, 'utc') IS NOT NULL
+        ''')
+    conn.execute(f'PRAGMA user_version = {EPOCH_TIMESTAMPS_VERSION}')
     conn.commit()
-    conn.close()
-    # print("Database initialized successfully!")  # Commented out to avoid spam
+
+def init_database():
+    """Initialize the tracking database and its connection pool"""
+    global db_pool
+    # Handlers call this on every request, so the initialized case must not
+    # take the lock or concurrent requests would queue up behind each other
+    if db_pool is not None:
+        return
+
+    with _init_lock:
+        if db_pool is not None:
+            return
+
+        pool = SQLitePool(DB_PATH)
+        try:
+            with pool.write() as conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS email_tracking (
+                        tracking_id TEXT PRIMARY KEY,
+                        recipient_email TEXT,
+                        subject TEXT,
+                        sent_at TIMESTAMP,
+                        opened_at INTEGER,
+                        open_count INTEGER DEFAULT 0,
+                        user_agent TEXT,
+                        ip_address TEXT
+                    )
+                ''')
+
+                # Also initialize link tracking
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS link_tracking (
+                        link_id TEXT PRIMARY KEY,
+                        original_url TEXT,
+                        email_id TEXT,
+                        recipient_email TEXT,
+                        created_at INTEGER,
+                        click_count INTEGER DEFAULT 0,
+                        last_clicked INTEGER,
+                        user_agent TEXT,
+                        ip_address TEXT
+                    )
+                ''')
+                migrate_legacy_link_db(conn)
+                migrate_text_timestamps(conn)
+
+                # Match the ORDER BY in /stats, /debug and /link-stats
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_email_sent_at ON email_tracking(sent_at DESC)')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_link_last_clicked ON link_tracking(last_clicked DESC, created_at DESC)')
+                conn.execute('ANALYZE')
+        except Exception:
+            # The next request retries, so don't leave these connections open
+            pool.close()
+            raise
+
+        # Published last so other threads never see a half-initialized database
+        db_pool = pool
+
+        for pending, write in ((pending_opens, write_opens), (pending_clicks, write_clicks)):
+            thread = threading.Thread(target=batch_writer, args=(pending, write), daemon=True)
+            thread.start()
+            _writer_threads.append(thread)
+        logger.info("Database initialized successfully!")
+
+# A link's destination never changes once created, so lookups are cached.
+# Unknown IDs raise instead of returning so lru_cache never remembers a miss
+@lru_cache(maxsize=100_000)
+def _lookup_original_url(link_id):
+    with db_pool.read() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SQL_SELECT_URL, (link_id,))
+        result = cursor.fetchone()
+    if result is None:
+        raise KeyError(link_id)
+    return result[0]
+
+def get_original_url(link_id):
+    """Return the destination URL for a tracked link, or None if it doesn't exist"""
+    try:
+        return _lookup_original_url(link_id)
+    except KeyError:
+        return None
+
+# Dashboards are refreshed by hand and the counters are already written in
+# batches, so serving them a few seconds stale is fine
+PAGE_CACHE_TIMEOUT = 10  # seconds
+
+def cached_page(view):
+    """Serve a view's HTML from memory for PAGE_CACHE_TIMEOUT seconds, per path and query string"""
+    pages = {}
+    # gthread workers serve requests concurrently, and store() walks the dict
+    pages_lock = threading.Lock()
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.full_path
+        now = time.monotonic()
+        cached = pages.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        body = view(*args, **kwargs)
+        expires = now + PAGE_CACHE_TIMEOUT
+
+        def store(html):
+            with pages_lock:
+                for stale in [k for k, (until, _) in pages.items() if until <= now]:
+                    del pages[stale]
+                pages[key] = (expires, html)
+
+        # Responses with an explicit status (errors) are never cached
+        if isinstance(body, tuple):
+            return body
+
+        if isinstance(body, str):
+            store(body)
+            return body
+
+        # Streamed templates are cached once the last chunk has gone out
+        def record(chunks):
+            parts = []
+            for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+            store(''.join(parts))
+
+        return record(body)
+
+    return wrapper
+
+# Mail proxies re-request the pixel in quick succession. A revalidation
+# from the same IP within REPEAT_OPEN_WINDOW of a recorded open gets a 304
+# and is not counted again
+REPEAT_OPEN_WINDOW = 60  # seconds
+REPEAT_OPEN_MAX_ENTRIES = 100_000
+
+# (tracking_id, ip_address) -> when the open was recorded, oldest first
+_recent_opens = {}
+_recent_opens_lock = threading.Lock()
+
+def is_repeat_open(tracking_id, ip_address):
+    """Return True if this open was already recorded within the window, otherwise remember it"""
+    key = (tracking_id, ip_address)
+    now = time.monotonic()
+    with _recent_opens_lock:
+        # Entries are kept in insertion order, so expired ones sit at the front
+        while _recent_opens:
+            oldest = next(iter(_recent_opens))
+            if (_recent_opens[oldest] > now - REPEAT_OPEN_WINDOW
+                    and len(_recent_opens) < REPEAT_OPEN_MAX_ENTRIES):
+                break
+            del _recent_opens[oldest]
+
+        if key in _recent_opens:
+            return True
+        _recent_opens[key] = now
+        return False
 
 @app.route('/')
 def home():
@@ -84,42 +563,21 @@ def track_email(tracking_id):
         user_agent = request.headers.get('User-Agent', 'Unknown')
         ip_address = request.remote_addr
         
-        print(f"📧 Email opened! Tracking ID: {tracking_id}")
-        print(f"   User Agent: {user_agent}")
-        print(f"   IP Address: {ip_address}")
-        
-        conn = sqlite3.connect('email_tracking.db')
-        cursor = conn.cursor()
-        
-        # Check if tracking ID exists
-        cursor.execute('SELECT open_count FROM email_tracking WHERE tracking_id = ?', (tracking_id,))
-        result = cursor.fetchone()
+        if (is_repeat_open(tracking_id, ip_address)
+                and request.headers.get('If-None-Match') == PIXEL_ETAG):
+            return '', 304, PIXEL_NOT_MODIFIED_HEADERS
         
-        if result:
-            open_count = result[0] or 0
-            
-            # Update tracking record
-            cursor.execute('''
-                UPDATE email_tracking 
-                SET opened_at = ?, 
-                    open_count = ?, 
-                    user_agent = ?, 
-                    ip_address = ?
-                WHERE tracking_id = ?
-            ''', (datetime.now(), open_count + 1, user_agent, ip_address, tracking_id))
-            
-            conn.commit()
-            print(f"   ✓ Database updated - Open count: {open_count + 1}")
-        else:
-            print(f"   ✗ Tracking ID not found in database: {tracking_id}")
+        logger.info("📧 Email opened! Tracking ID: %s, User Agent: %s, IP Address: %s",
+                    tracking_id, user_agent, ip_address)
         
-        conn.close()
+        # Recorded by the open batch writer
+        pending_opens.add(tracking_id, user_agent, ip_address)
         
     except Exception as e:
-        print(f"Tracking error: {e}")
+        logger.error("Tracking error: %s", e)
     
     # Return transparent pixel
-    return Response(TRACKING_PIXEL, mimetype='image/gif')
+    return TRACKING_PIXEL, 200, PIXEL_RESPONSE_HEADERS
 
 @app.route('/click/<link_id>')
 def track_link_click(link_id):
@@ -131,175 +589,139 @@ def track_link_click(link_id):
         user_agent = request.headers.get('User-Agent', 'Unknown')
         ip_address = request.remote_addr
         
-        print(f"🔗 Link clicked! Link ID: {link_id}")
-        print(f"   User Agent: {user_agent}")
-        print(f"   IP Address: {ip_address}")
-        
-        conn = sqlite3.connect('link_tracking.db')
-        cursor = conn.cursor()
-        
-        # Get original URL and update click count
-        cursor.execute('SELECT original_url, click_count FROM link_tracking WHERE link_id = ?', (link_id,))
-        result = cursor.fetchone()
+        logger.info("🔗 Link clicked! Link ID: %s, User Agent: %s, IP Address: %s",
+                    link_id, user_agent, ip_address)
         
-        if result:
-            original_url, click_count = result
-            
-            # Update click tracking
-            cursor.execute('''
-                UPDATE link_tracking 
-                SET click_count = ?, 
-                    last_clicked = ?, 
-                    user_agent = ?, 
-                    ip_address = ?
-                WHERE link_id = ?
-            ''', (click_count + 1, datetime.now(), user_agent, ip_address, link_id))
-            
-            conn.commit()
-            conn.close()
-            
-            print(f"   ✓ Redirecting to: {original_url}")
-            print(f"   ✓ Click count: {click_count + 1}")
+        # Only the (usually cached) URL lookup stays on the request path
+        original_url = get_original_url(link_id)
+
+        if original_url:
+            # Click count is updated by the click batch writer
+            pending_clicks.add(link_id, user_agent, ip_address)
+
+            logger.info("✓ Redirecting %s to: %s", link_id, original_url)
             
             # Redirect to original URL
             return redirect(original_url)
         else:
-            conn.close()
             return "Link not found", 404
             
     except Exception as e:
-        print(f"Link tracking error: {e}")
+        logger.error("Link tracking error: %s", e)
         return "Error processing link", 500
 
+@app.template_filter('datetimeformat')
+def datetimeformat(value):
+    """Render an epoch-seconds timestamp in server local time"""
+    if isinstance(value, int):
+        return datetime.fromtimestamp(value).strftime('%Y-%m-%d %H:%M:%S')
+    # Text written by an older sender is shown as-is
+    return value
+
+# Stats pages are rendered by Jinja, which autoescapes the user-supplied
+# subjects, user agents and URLs
+LINK_STATS_TEMPLATE = '''<html><head><title>Link Tracking Stats</title>
+<style>table {border-collapse: collapse; width: 100%;} th, td {border: 1px solid #ddd; padding: 8px; text-align: left;} th {background-color: #f2f2f2;}</style>
+</head><body><h1>🔗 Link Tracking Statistics</h1>
+<p>Total tracked links: {{ results|length }}</p>
+<table><tr><th>Recipient</th><th>Original URL</th><th>Clicks</th><th>Last Clicked</th><th>Created</th></tr>
+{% for row in results %}
+<tr><td>{{ row[0] }}</td><td title="{{ row[1] }}">{{ row[1][:50] ~ '...' if row[1]|length > 50 else row[1] }}</td><td>{{ row[2] }}</td><td>{{ row[3]|datetimeformat or 'Never' }}</td><td>{{ row[4]|datetimeformat }}</td></tr>
+{% else %}
+<tr><td colspan="5">No link clicks tracked yet.</td></tr>
+{% endfor %}
+</table></body></html>'''
+
 @app.route('/link-stats')
+@cached_page
 def view_link_stats():
     """View link tracking statistics"""
     # Ensure database exists
     init_database()
     
-    conn = sqlite3.connect('link_tracking.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT 
-            recipient_email,
-            original_url,
-            click_count,
-            last_clicked,
-            created_at
-        FROM link_tracking
-        ORDER BY last_clicked DESC, created_at DESC
-        LIMIT 100
-    ''')
-    
-    results = cursor.fetchall()
-    conn.close()
-    
-    # Build HTML response
-    html = '<html><head><title>Link Tracking Stats</title>'
-    html += '<style>table {border-collapse: collapse; width: 100%;} th, td {border: 1px solid #ddd; padding: 8px; text-align: left;} th {background-color: #f2f2f2;}</style>'
-    html += '</head><body><h1>🔗 Link Tracking Statistics</h1>'
-    
-    html += f'<p>Total tracked links: {len(results)}</p>'
-    html += '<table><tr><th>Recipient</th><th>Original URL</th><th>Clicks</th><th>Last Clicked</th><th>Created</th></tr>'
-    
-    if not results:
-        html += '<tr><td colspan="5">No link clicks tracked yet.</td></tr>'
-    else:
-        for row in results:
-            last_clicked = row[3] if row[3] else 'Never'
-            # Truncate long URLs
-            url_display = row[1][:50] + '...' if len(row[1]) > 50 else row[1]
-            html += f'<tr><td>{row[0]}</td><td title="{row[1]}">{url_display}</td><td>{row[2]}</td><td>{last_clicked}</td><td>{row[4]}</td></tr>'
-    
-    html += '</table></body></html>'
+    with db_pool.read() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(SQL_SELECT_LINK_STATS)
+
+        results = cursor.fetchall()
     
-    return html
+    return stream_template_string(LINK_STATS_TEMPLATE, results=results)
+
+STATS_TEMPLATE = '''<html><head><title>Email Tracking Stats</title>
+<style>table {border-collapse: collapse; width: 100%;} th, td {border: 1px solid #ddd; padding: 8px; text-align: left;} th {background-color: #f2f2f2;}</style>
+</head><body><h1>📊 Email Open Statistics</h1>
+<p>Total records: {{ results|length }}</p>
+<table><tr><th>Recipient</th><th>Subject</th><th>Sent</th><th>Opened</th><th>Opens</th><th>User Agent</th></tr>
+{% for row in results %}
+<tr><td>{{ row[0] }}</td><td>{{ row[1] }}</td><td>{{ row[2]|datetimeformat }}</td><td>{{ row[3]|datetimeformat or 'Not opened' }}</td><td>{{ row[4] or 0 }}</td><td>{{ row[5] or 'N/A' }}</td></tr>
+{% else %}
+<tr><td colspan="6">No emails tracked yet.</td></tr>
+{% endfor %}
+</table></body></html>'''
 
 @app.route('/stats')
+@cached_page
 def view_stats():
     """View email tracking statistics"""
     # Ensure database exists
     init_database()
     
-    conn = sqlite3.connect('email_tracking.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT 
-            recipient_email,
-            subject,
-            sent_at,
-            opened_at,
-            open_count,
-            user_agent
-        FROM email_tracking
-        ORDER BY sent_at DESC
-        LIMIT 100
-    ''')
-    
-    results = cursor.fetchall()
-    conn.close()
-    
-    # Build HTML response
-    html = '<html><head><title>Email Tracking Stats</title>'
-    html += '<style>table {border-collapse: collapse; width: 100%;} th, td {border: 1px solid #ddd; padding: 8px; text-align: left;} th {background-color: #f2f2f2;}</style>'
-    html += '</head><body><h1>📊 Email Open Statistics</h1>'
-    
-    html += f'<p>Total records: {len(results)}</p>'
-    
-    html += '<table><tr><th>Recipient</th><th>Subject</th><th>Sent</th><th>Opened</th><th>Opens</th><th>User Agent</th></tr>'
-    
-    if not results:
-        html += '<tr><td colspan="6">No emails tracked yet.</td></tr>'
-    else:
-        for row in results:
-            opened = row[3] if row[3] else 'Not opened'
-            opens = row[4] if row[4] else 0
-            html += f'<tr><td>{row[0]}</td><td>{row[1]}</td><td>{row[2]}</td><td>{opened}</td><td>{opens}</td><td>{row[5] or "N/A"}</td></tr>'
-    
-    html += '</table></body></html>'
+    with db_pool.read() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(SQL_SELECT_STATS)
+
+        results = cursor.fetchall()
     
-    return html
+    return stream_template_string(STATS_TEMPLATE, results=results)
+
+DEBUG_PAGE_SIZE = 100
+DEBUG_MAX_PAGE_SIZE = 1000
+
+DEBUG_TEMPLATE = '''<html><body><h1>Database Debug</h1>
+<p>Table exists: {{ table_exists }}</p>
+{% if count is not none %}<p>Record count: {{ count }}</p>{% endif %}
+<h2>Records (page {{ page }}, {{ size }} per page):</h2>
+<pre>
+{% for record in records %}{{ record }}
+{% endfor %}</pre>
+<p>{% if page > 1 %}<a href="?page={{ page - 1 }}&size={{ size }}">&larr; Previous</a> {% endif %}{% if records|length == size %}<a href="?page={{ page + 1 }}&size={{ size }}">Next &rarr;</a>{% endif %}</p>
+</body></html>'''
 
 @app.route('/debug')
+@cached_page
 def debug_database():
-    """Debug database contents"""
+    """Debug database contents, one page at a time (?page=N&size=M)"""
     try:
         # Ensure database exists
         init_database()
         
-        conn = sqlite3.connect('email_tracking.db')
-        cursor = conn.cursor()
-        
-        # Check if table exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='email_tracking'")
-        table_exists = cursor.fetchone()
-        
-        # Count records
-        cursor.execute("SELECT COUNT(*) FROM email_tracking")
-        count = cursor.fetchone()[0] if table_exists else 0
-        
-        # Get all records
-        cursor.execute("SELECT * FROM email_tracking ORDER BY sent_at DESC")
-        records = cursor.fetchall()
-        
-        conn.close()
+        page = max(request.args.get('page', 1, type=int), 1)
+        size = min(max(request.args.get('size', DEBUG_PAGE_SIZE, type=int), 1), DEBUG_MAX_PAGE_SIZE)
         
-        html = '<html><body><h1>Database Debug</h1>'
-        html += f'<p>Table exists: {bool(table_exists)}</p>'
-        html += f'<p>Record count: {count}</p>'
-        html += '<h2>All Records:</h2>'
-        html += '<pre>'
-        for record in records:
-            html += str(record) + '\n'
-        html += '</pre>'
-        html += '</body></html>'
+        with db_pool.read() as conn:
+            cursor = conn.cursor()
+
+            # Check if table exists
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='email_tracking'")
+            table_exists = cursor.fetchone()
+
+            # Counting is a full scan, so only the first page shows it
+            count = None
+            if page == 1:
+                cursor.execute("SELECT COUNT(*) FROM email_tracking")
+                count = cursor.fetchone()[0] if table_exists else 0
+
+            cursor.execute("SELECT * FROM email_tracking ORDER BY sent_at DESC LIMIT ? OFFSET ?",
+                           (size, (page - 1) * size))
+            records = cursor.fetchall()
         
-        return html
+        return stream_template_string(DEBUG_TEMPLATE, table_exists=bool(table_exists), count=count,
+                                      records=records, page=page, size=size)
         
     except Exception as e:
-        return f'<html><body><h1>Debug Error</h1><p>{str(e)}</p></body></html>'
+        return f'<html><body><h1>Debug Error</h1><p>{str(e)}</p></body></html>', 500
 
 @app.route('/api/add-link', methods=['POST'])
 def add_link():
@@ -313,29 +735,20 @@ def add_link():
         if not data or not all(k in data for k in ['link_id', 'original_url', 'email_id', 'recipient_email']):
             return {'error': 'Missing required fields'}, 400
         
-        conn = sqlite3.connect('link_tracking.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO link_tracking 
-            (link_id, original_url, email_id, recipient_email, created_at) 
-            VALUES (?, ?, ?, ?, ?)
-        ''', (data['link_id'], data['original_url'], data['email_id'], 
-              data['recipient_email'], datetime.now()))
-        
-        conn.commit()
-        conn.close()
+        with db_pool.write() as conn:
+            conn.execute(SQL_INSERT_LINK, (data['link_id'], data['original_url'], data['email_id'], 
+                  data['recipient_email'], int(time.time())))
         
         return {'success': True, 'link_id': data['link_id']}, 200
         
     except Exception as e:
-        print(f"API add-link error: {e}")
+        logger.error("API add-link error: %s", e)
         return {'error': str(e)}, 500
 
 if __name__ == '__main__':
     # Initialize database first
     init_database()
     
-    # Run server
+    # Run server (development only - deploy with: gunicorn -c gunicorn_conf.py tracking_server:app)
     print("Starting email tracking server")
     app.run(host='0.0.0.0', port=5000, debug=False)